@@ -3,10 +3,25 @@ use clap::{Parser, Subcommand};
 use rusqlite::{Connection, OptionalExtension, params};
 use serde::{Deserialize, Serialize};
 use std::fmt::Display;
-use std::io::{IsTerminal, Read, Write};
+use std::io::{BufRead, IsTerminal, Read, Write};
 use std::path::{Path, PathBuf};
 
 const DEFAULT_NAMESPACE: &str = "default";
+/// Separates the arguments of a single command in `repl` mode
+const REPL_ARG_SEPARATOR: char = '\x1e';
+const SET_QUERY: &str = "
+    insert into entries (namespace, key, value, inserted_at)
+    values (
+        ?1,
+        ?2,
+        ?3,
+        strftime('%Y-%m-%d %H:%M:%S', ?4 / 1000000, 'unixepoch') || printf('.%06d', ?4 % 1000000)
+    )
+    on conflict do update
+    set value = excluded.value
+    where namespace = excluded.namespace
+    and key = excluded.key;
+    ";
 
 #[derive(Parser)]
 struct Options {
@@ -31,6 +46,9 @@ enum Command {
         namespaced_key: String,
         value: Option<String>,
     },
+    /// Set many keys in a single transaction, read from stdin as
+    /// `key[@namespace]\tvalue` lines, like `blade bulk-set < pairs.tsv`
+    BulkSet,
     /// Delete a key. `key[@namespace]`
     Delete { namespaced_key: String },
     /// List all keys. Optionally with namespace and delimiter (default: `\t`)
@@ -43,6 +61,19 @@ enum Command {
     ListNamespaces,
     /// Print the current config
     DumpConfig,
+    /// Read commands from stdin, one per line, with arguments separated by `\x1e`.
+    /// Each response is written to stdout as a `<exit code> <stdout length> <stderr length>\n`
+    /// header followed by that many bytes of stdout and stderr
+    #[command(hide = true)]
+    Repl,
+}
+
+/// A single command read in `repl` mode
+#[derive(Parser)]
+#[command(no_binary_name = true)]
+struct ReplLine {
+    #[command(subcommand)]
+    command: Command,
 }
 
 #[derive(Serialize, Deserialize)]
@@ -111,15 +142,45 @@ fn get_or_create_config_file() -> anyhow::Result<Config> {
     let config: Config = match std::fs::read_to_string(&config_path) {
         Ok(f) => toml::from_str(&f)?,
         Err(_) => {
-            let mut f = std::fs::File::create_new(&config_path)?;
-
             let config = Config::default();
 
             let s = toml::to_string(&config)?;
 
-            f.write_all(s.as_bytes())?;
+            // Write the config out in full under a name unique to this process,
+            // then link it into place, so that concurrent invocations
+            // (like a parallel test run) never see a partially written config
+            let mut tmp_path = config_path.clone();
+            tmp_path.set_extension(format!("toml.{}.tmp", std::process::id()));
+
+            std::fs::write(&tmp_path, &s)?;
 
-            config
+            let linked = std::fs::hard_link(&tmp_path, &config_path);
+
+            // only cleanup, so failing to remove it shouldn't fail the command
+            let _ = std::fs::remove_file(&tmp_path);
+
+            let read_existing_config = || -> anyhow::Result<Config> {
+                Ok(toml::from_str(&std::fs::read_to_string(&config_path)?)?)
+            };
+
+            match linked {
+                Ok(()) => config,
+                // another invocation created it first
+                Err(e) if e.kind() == std::io::ErrorKind::AlreadyExists => read_existing_config()?,
+                // not every filesystem supports hard links (some FUSE, network, or FAT mounts),
+                // so fall back to creating the file in place
+                Err(_) => match std::fs::File::create_new(&config_path) {
+                    Ok(mut f) => {
+                        f.write_all(s.as_bytes())?;
+
+                        config
+                    }
+                    Err(e) if e.kind() == std::io::ErrorKind::AlreadyExists => {
+                        read_existing_config()?
+                    }
+                    Err(e) => Err(e)?,
+                },
+            }
         }
     };
 
@@ -191,6 +252,16 @@ fn migrate_db(conn: Connection) -> anyhow::Result<Connection> {
     Ok(conn)
 }
 
+/// Microseconds since the unix epoch.
+/// `set` stores `inserted_at` at this precision rather than SQLite's millisecond `'now'`,
+/// so `list` keeps the insertion order of keys set in quick succession
+fn unix_micros() -> anyhow::Result<i64> {
+    Ok(std::time::SystemTime::now()
+        .duration_since(std::time::UNIX_EPOCH)?
+        .as_micros()
+        .try_into()?)
+}
+
 struct Key<'input> {
     namespace: &'input str,
     name: &'input str,
@@ -235,6 +306,77 @@ fn main() -> anyhow::Result<()> {
     let conn = migrate_db(conn)?;
 
     match options.command {
+        Command::Repl => repl(&conn, &config),
+        command => execute(
+            &conn,
+            &config,
+            command,
+            Some(&mut std::io::stdin()),
+            &mut std::io::stdout().lock(),
+        ),
+    }
+}
+
+fn repl(conn: &Connection, config: &Config) -> anyhow::Result<()> {
+    let mut stdin = std::io::stdin().lock();
+    let mut out = std::io::stdout().lock();
+    let mut line = vec![];
+    let mut command_out = vec![];
+
+    loop {
+        line.clear();
+
+        if stdin.read_until(b'\n', &mut line)? == 0 {
+            break;
+        }
+
+        if line.last() == Some(&b'\n') {
+            line.pop();
+        }
+
+        command_out.clear();
+
+        // a line that isn't utf-8 gets an error response, rather than ending the repl
+        let result = std::str::from_utf8(&line)
+            .map_err(anyhow::Error::from)
+            .and_then(|line| {
+                ReplLine::try_parse_from(line.split(REPL_ARG_SEPARATOR))
+                    .map_err(anyhow::Error::from)
+            })
+            .and_then(|ReplLine { command }| {
+                execute(conn, config, command, None, &mut command_out)
+            });
+
+        let (exit_code, command_err) = match result {
+            Ok(()) => (0, String::new()),
+            Err(e) => (1, format!("Error: {e:?}\n")),
+        };
+
+        writeln!(
+            out,
+            "{} {} {}",
+            exit_code,
+            command_out.len(),
+            command_err.len()
+        )?;
+        out.write_all(&command_out)?;
+        out.write_all(command_err.as_bytes())?;
+        out.flush()?;
+    }
+
+    Ok(())
+}
+
+/// `input` is where `set` reads its value from when none is given,
+/// and is `None` in `repl` mode, where stdin carries the commands themselves
+fn execute(
+    conn: &Connection,
+    config: &Config,
+    command: Command,
+    input: Option<&mut dyn Read>,
+    out: &mut dyn Write,
+) -> anyhow::Result<()> {
+    match command {
         Command::Get { namespaced_key } => {
             let key = split_maybe_qualified_key(&namespaced_key)?;
 
@@ -255,10 +397,8 @@ fn main() -> anyhow::Result<()> {
 
             if let Some(value) = value {
                 if std::io::stdin().is_terminal() && std::str::from_utf8(&value).is_err() {
-                    let mut out = std::io::stdout();
                     out.write_all(format!("binary data ({} bytes)\n", value.len()).as_bytes())?;
                 } else {
-                    let mut out = std::io::stdout();
                     out.write_all(&value)?;
                     out.write_all(b"\n")?;
                 }
@@ -270,27 +410,58 @@ fn main() -> anyhow::Result<()> {
         } => {
             let key = split_maybe_qualified_key(&namespaced_key)?;
 
-            const SET_QUERY: &str = "
-                    insert into entries (namespace, key, value)
-                    values (?, ?, ?)
-                    on conflict do update
-                    set value = excluded.value
-                    where namespace = excluded.namespace
-                    and key = excluded.key;
-                    ";
-
             if let Some(value) = value {
                 conn.execute(
                     SET_QUERY,
-                    params![key.namespace, key.name, value.as_bytes()],
+                    params![key.namespace, key.name, value.as_bytes(), unix_micros()?],
                 )?;
             } else {
+                let input = input.ok_or(anyhow!("a value is required when running in the repl"))?;
+
                 let mut value = vec![];
 
-                std::io::stdin().read_to_end(&mut value)?;
+                input.read_to_end(&mut value)?;
+
+                conn.execute(
+                    SET_QUERY,
+                    params![key.namespace, key.name, value, unix_micros()?],
+                )?;
+            }
+        }
+        Command::BulkSet => {
+            let input = input.ok_or(anyhow!("bulk-set is not available in the repl"))?;
+
+            let mut pairs = vec![];
+
+            input.read_to_end(&mut pairs)?;
+
+            let tx = conn.unchecked_transaction()?;
+
+            {
+                let mut q = tx.prepare(SET_QUERY)?;
+
+                // rows in one transaction can share a microsecond,
+                // so force each line's `inserted_at` past the previous line's
+                let mut last_inserted_at = 0;
+
+                for line in pairs.split(|b| *b == b'\n').filter(|line| !line.is_empty()) {
+                    let delimiter = line
+                        .iter()
+                        .position(|b| *b == b'\t')
+                        .ok_or(anyhow!("expected `key[@namespace]\\tvalue`"))?;
+
+                    let (namespaced_key, value) = (&line[..delimiter], &line[delimiter + 1..]);
 
-                conn.execute(SET_QUERY, params![key.namespace, key.name, value])?;
+                    let key = split_maybe_qualified_key(std::str::from_utf8(namespaced_key)?)?;
+
+                    let inserted_at = unix_micros()?.max(last_inserted_at + 1);
+                    last_inserted_at = inserted_at;
+
+                    q.execute(params![key.namespace, key.name, value, inserted_at])?;
+                }
             }
+
+            tx.commit()?;
         }
         Command::Delete { namespaced_key } => {
             let key = split_maybe_qualified_key(&namespaced_key)?;
@@ -325,8 +496,6 @@ fn main() -> anyhow::Result<()> {
 
             let is_terminal = std::io::stdin().is_terminal();
 
-            let mut out = std::io::stdout().lock();
-
             for row in rows {
                 let (key, value): (String, Vec<u8>) = row?;
 
@@ -354,8 +523,6 @@ fn main() -> anyhow::Result<()> {
 
             let rows = q.query_map([], |row| row.get(0))?;
 
-            let mut out = std::io::stdout().lock();
-
             for row in rows {
                 let row: String = row?;
                 writeln!(out, "{}", row)?;
@@ -363,9 +530,9 @@ fn main() -> anyhow::Result<()> {
         }
         Command::DumpConfig => {
             let s = toml::to_string_pretty(&config)?;
-            let mut out = std::io::stdout();
             writeln!(out, "{}", s)?;
         }
+        Command::Repl => return Err(anyhow!("cannot start a repl from within a repl")),
     }
 
     Ok(())
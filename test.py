@@ -1,74 +1,133 @@
 import os
-import random
-import string
+import shutil
+import sqlite3
 import subprocess
 import tempfile
 import typing
 import unittest
+import uuid
 from contextlib import contextmanager
 
+_BASE_ENV = dict(os.environ)
+_BLADE = shutil.which("blade") or "blade"
 
-def run(db, args):
-    my_env = os.environ.copy()
-    my_env["DB_LOCATION"] = db
-    return subprocess.run(args, capture_output=True, text=True, env=my_env)
+
+class BladeSession:
+    """A single long-lived `blade repl` process, so that each command
+    is a round-trip over its stdin/stdout rather than a fresh process."""
+
+    def __init__(self, db):
+        self.process = subprocess.Popen(
+            [_BLADE, "repl"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            # command errors come back framed on stdout,
+            # so only crashes (like panics) show up here
+            stderr=None,
+            env=_BASE_ENV | {"DB_LOCATION": db},
+        )
+
+    def cmd(self, args):
+        for arg in args:
+            if "\n" in arg or "\x1e" in arg:
+                raise ValueError(f"repl arguments cannot contain \\n or \\x1e: {arg!r}")
+
+        self.process.stdin.write(("\x1e".join(args) + "\n").encode("utf-8"))
+        self.process.stdin.flush()
+
+        return self.read_response(args)
+
+    def read_response(self, args):
+        header = self.process.stdout.readline()
+        if not header:
+            raise RuntimeError("blade repl exited unexpectedly")
+
+        returncode, stdout_len, stderr_len = (int(n) for n in header.split())
+        stdout = self.process.stdout.read(stdout_len)
+        stderr = self.process.stdout.read(stderr_len)
+
+        return subprocess.CompletedProcess([_BLADE, *args], returncode, stdout, stderr)
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+        self.process.stdout.close()
 
 
 def generate_random_string(length):
     """Generates a general-purpose, random alphanumeric string of a specified length."""
-    characters = string.ascii_letters + string.digits
-    # random.choices returns a list, which we join into a single string
-    return "".join(random.choices(characters, k=length))
+    # hex rather than urlsafe base64, so a key never starts with `-` and parses as a flag
+    return os.urandom((length + 1) // 2).hex()[:length]
+
+
+def run_process(db, args):
+    """Runs `blade` as its own process, rather than through a `BladeSession`."""
+    return subprocess.run(
+        [_BLADE, *args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        env=_BASE_ENV | {"DB_LOCATION": db},
+    )
 
 
-def get(db, key):
-    return run(db, ["blade", "get", key])
+def get(session, key):
+    return session.cmd(["get", key])
 
 
-def set(db, key, value):
-    return run(db, ["blade", "set", key, value])
+def set(session, key, value):
+    return session.cmd(["set", key, value])
 
 
 def set_from_stdin_str(db, key, value: str):
-    my_env = os.environ.copy()
-    my_env["DB_LOCATION"] = db
     return subprocess.run(
-        ["blade", "set", key],
-        capture_output=True,
-        text=True,
-        check=True,
-        env=my_env,
-        input=value,
+        [_BLADE, "set", key],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        env=_BASE_ENV | {"DB_LOCATION": db},
+        input=value.encode("utf-8"),
     )
 
 
 def set_from_file_redirection(db, key, file: int | typing.IO[typing.Any]):
-    my_env = os.environ.copy()
-    my_env["DB_LOCATION"] = db
     return subprocess.run(
-        ["blade", "set", key],
-        capture_output=True,
-        text=True,
-        check=True,
-        env=my_env,
+        [_BLADE, "set", key],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        env=_BASE_ENV | {"DB_LOCATION": db},
         stdin=file,
     )
 
 
-def delete(db, key):
-    return run(db, ["blade", "delete", key])
+def bulk_set_from_stdin_str(db, pairs: str):
+    return subprocess.run(
+        [_BLADE, "bulk-set"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        env=_BASE_ENV | {"DB_LOCATION": db},
+        input=pairs.encode("utf-8"),
+    )
+
+
+def bulk_set(db, pairs):
+    return bulk_set_from_stdin_str(
+        db, "".join(f"{key}\t{value}\n" for key, value in pairs)
+    )
+
 
+def delete(session, key):
+    return session.cmd(["delete", key])
 
-def list(db):
-    return run(db, ["blade", "list"])
 
+def list(session):
+    return session.cmd(["list"])
 
-def list_with_namespace(db, ns):
-    return run(db, ["blade", "list", ns])
 
+def list_with_namespace(session, ns):
+    return session.cmd(["list", ns])
 
-def dump_config(db):
-    return run(db, ["blade", "dump-config"])
+
+def dump_config(session):
+    return session.cmd(["dump-config"])
 
 
 @contextmanager
@@ -84,204 +143,358 @@ def random_kv(ns=None):
 
 
 @contextmanager
-def test_db():
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        db = tmpdirname + "/test.db"
-        yield db
+def test_db(tmpdirname):
+    db = f"{tmpdirname}/{uuid.uuid4().hex}.db"
+    session = BladeSession(db)
+    try:
+        yield db, session
+    finally:
+        session.close()
+
+
+# keep pytest from collecting this as a test
+test_db.__test__ = False
 
 
 class TestBlade(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # every test gets its own db file in this one directory
+        cls.tmpdir = tempfile.TemporaryDirectory()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
     def test_get_and_set(self):
-        with test_db() as db, random_kv() as (key, value):
-            set_out = set(db, key, value)
+        with test_db(self.tmpdir.name) as (_db, session), random_kv() as (key, value):
+            set_out = set(session, key, value)
 
             self.assertEqual(set_out.returncode, 0)
 
-            get_out = get(db, key)
+            get_out = get(session, key)
 
             self.assertEqual(get_out.returncode, 0)
-            self.assertEqual(get_out.stdout, value + "\n")
+            self.assertEqual(get_out.stdout, (value + "\n").encode("utf-8"))
 
     def test_get_and_set_from_stdin(self):
-        with test_db() as db, random_kv() as (key, value):
+        with test_db(self.tmpdir.name) as (db, session), random_kv() as (key, value):
             set_out = set_from_stdin_str(db, key, value)
 
             self.assertEqual(set_out.returncode, 0)
 
-            get_out = get(db, key)
+            get_out = get(session, key)
 
             self.assertEqual(get_out.returncode, 0)
-            self.assertEqual(get_out.stdout, value + "\n")
+            self.assertEqual(get_out.stdout, (value + "\n").encode("utf-8"))
 
     def test_get_and_set_from_stdin_fd(self):
-        with (
-            test_db() as db,
-            random_kv() as (key, value),
-            tempfile.NamedTemporaryFile() as file,
-        ):
-            file_contents = "hello world"
-            file.write(bytes(file_contents, "utf-8"))
-            file.seek(0)
+        with test_db(self.tmpdir.name) as (db, session), random_kv() as (key, value):
+            file_contents = b"hello world"
+
+            read_fd, write_fd = os.pipe()
+            os.write(write_fd, file_contents)
+            os.close(write_fd)
 
-            set_out = set_from_file_redirection(db, key, file)
+            try:
+                set_out = set_from_file_redirection(db, key, read_fd)
+            finally:
+                os.close(read_fd)
 
             self.assertEqual(set_out.returncode, 0)
 
-            get_out = get(db, key)
+            get_out = get(session, key)
 
             self.assertEqual(get_out.returncode, 0)
-            self.assertEqual(get_out.stdout, file_contents + "\n")
+            self.assertEqual(get_out.stdout, file_contents + b"\n")
 
     def test_get_and_set_with_namespaces(self):
-        with test_db() as db:
+        with test_db(self.tmpdir.name) as (_db, session):
             key1 = "key@ns1"
             value1 = "value1"
 
             key2 = "key@ns2"
             value2 = "other value"
 
-            set_out1 = set(db, key1, value1)
+            set_out1 = set(session, key1, value1)
 
             self.assertEqual(set_out1.returncode, 0)
 
-            get_out1 = get(db, key1)
+            get_out1 = get(session, key1)
 
             self.assertEqual(get_out1.returncode, 0)
-            self.assertEqual(get_out1.stdout, value1 + "\n")
+            self.assertEqual(get_out1.stdout, (value1 + "\n").encode("utf-8"))
 
-            set_out2 = set(db, key2, value2)
+            set_out2 = set(session, key2, value2)
 
             self.assertEqual(set_out2.returncode, 0)
 
-            get_out2 = get(db, key2)
+            get_out2 = get(session, key2)
 
             self.assertEqual(get_out2.returncode, 0)
-            self.assertEqual(get_out2.stdout, value2 + "\n")
+            self.assertEqual(get_out2.stdout, (value2 + "\n").encode("utf-8"))
 
             self.assertNotEqual(get_out1.stdout, get_out2.stdout)
 
     def test_delete(self):
-        with test_db() as db, random_kv() as (key, value):
-            set_out = set(db, key, value)
+        with test_db(self.tmpdir.name) as (_db, session), random_kv() as (key, value):
+            set_out = set(session, key, value)
             self.assertEqual(set_out.returncode, 0)
 
-            get_out = get(db, key)
+            get_out = get(session, key)
             self.assertEqual(get_out.returncode, 0)
-            self.assertEqual(get_out.stdout, value + "\n")
+            self.assertEqual(get_out.stdout, (value + "\n").encode("utf-8"))
 
-            delete_out = delete(db, key)
+            delete_out = delete(session, key)
             self.assertEqual(delete_out.returncode, 0)
             self.assertEqual(delete_out.returncode, 0)
-            self.assertEqual(delete_out.stdout, "")
+            self.assertEqual(delete_out.stdout, b"")
 
     def test_list(self):
         self.maxDiff = None
 
         with (
-            test_db() as db,
+            test_db(self.tmpdir.name) as (_db, session),
             random_kv() as (key1, value1),
             random_kv() as (key2, value2),
             random_kv() as (key3, value3),
         ):
-            set_out = set(db, key1, value1)
+            set_out = set(session, key1, value1)
             self.assertEqual(set_out.returncode, 0)
 
-            set_out2 = set(db, key2, value2)
+            set_out2 = set(session, key2, value2)
             self.assertEqual(set_out2.returncode, 0)
 
-            set_out3 = set(db, key3, value3)
+            set_out3 = set(session, key3, value3)
             self.assertEqual(set_out3.returncode, 0)
 
-            list_out = list(db)
+            list_out = list(session)
 
             self.assertEqual(list_out.returncode, 0)
 
-            self.assertEqual(
-                list_out.stdout,
-                "\n".join(
-                    [
-                        "\t".join([key3, value3]),
-                        "\t".join([key2, value2]),
-                        "\t".join([key1, value1]),
-                    ]
-                )
-                + "\n",
-            )
+            expected = f"{key3}\t{value3}\n{key2}\t{value2}\n{key1}\t{value1}\n"
+
+            self.assertEqual(list_out.stdout, expected.encode("utf-8"))
 
     def test_list_with_namespaces(self):
         self.maxDiff = None
 
         with (
-            test_db() as db,
+            test_db(self.tmpdir.name) as (_db, session),
             random_kv("ns1") as (key1, value1),
             random_kv("ns2") as (key2, value2),
             random_kv("ns2") as (key3, value3),
         ):
-            set_out = set(db, key1, value1)
+            set_out = set(session, key1, value1)
             self.assertEqual(set_out.returncode, 0)
 
-            set_out2 = set(db, key2, value2)
+            set_out2 = set(session, key2, value2)
             self.assertEqual(set_out2.returncode, 0)
 
-            set_out3 = set(db, key3, value3)
+            set_out3 = set(session, key3, value3)
             self.assertEqual(set_out3.returncode, 0)
 
-            list_out = list_with_namespace(db, "ns1")
+            list_out = list_with_namespace(session, "ns1")
 
             self.assertEqual(list_out.returncode, 0)
 
-            self.assertEqual(
-                list_out.stdout,
-                "\n".join(
-                    [
-                        "\t".join([key1.removesuffix("@ns1"), value1]),
-                    ]
-                )
-                + "\n",
-            )
+            expected = f"{key1.removesuffix('@ns1')}\t{value1}\n"
+
+            self.assertEqual(list_out.stdout, expected.encode("utf-8"))
 
-            list_out2 = list_with_namespace(db, "ns2")
+            list_out2 = list_with_namespace(session, "ns2")
 
             self.assertEqual(list_out2.returncode, 0)
 
-            self.assertEqual(
-                list_out2.stdout,
-                "\n".join(
-                    [
-                        "\t".join([key3.removesuffix("@ns2"), value3]),
-                        "\t".join([key2.removesuffix("@ns2"), value2]),
-                    ]
+            expected2 = (
+                f"{key3.removesuffix('@ns2')}\t{value3}\n"
+                f"{key2.removesuffix('@ns2')}\t{value2}\n"
+            )
+
+            self.assertEqual(list_out2.stdout, expected2.encode("utf-8"))
+
+    def test_list_puts_new_rows_before_millisecond_timestamped_rows(self):
+        with (
+            test_db(self.tmpdir.name) as (db, session),
+            random_kv() as (old_key, old_value),
+            random_kv() as (new_key, new_value),
+        ):
+            # a response means the repl has created the schema
+            self.assertEqual(list(session).returncode, 0)
+
+            # rows written before `set` bound microseconds got SQLite's millisecond 'now'
+            with sqlite3.connect(db) as conn:
+                conn.execute(
+                    "insert into entries (namespace, key, value) values ('default', ?, ?)",
+                    (old_key, old_value.encode("utf-8")),
                 )
-                + "\n",
+            conn.close()
+
+            self.assertEqual(set(session, new_key, new_value).returncode, 0)
+
+            list_out = list(session)
+
+            self.assertEqual(list_out.returncode, 0)
+
+            expected = f"{new_key}\t{new_value}\n{old_key}\t{old_value}\n"
+
+            self.assertEqual(list_out.stdout, expected.encode("utf-8"))
+
+    def test_bulk_set_keeps_insertion_order(self):
+        self.maxDiff = None
+
+        with (
+            test_db(self.tmpdir.name) as (db, session),
+            random_kv() as (key1, value1),
+            random_kv() as (key2, value2),
+            random_kv() as (key3, value3),
+        ):
+            set_out = bulk_set(db, [(key1, value1), (key2, value2), (key3, value3)])
+            self.assertEqual(set_out.returncode, 0)
+
+            list_out = list(session)
+
+            self.assertEqual(list_out.returncode, 0)
+
+            expected = f"{key3}\t{value3}\n{key2}\t{value2}\n{key1}\t{value1}\n"
+
+            self.assertEqual(list_out.stdout, expected.encode("utf-8"))
+
+    def test_bulk_set_errors_on_line_without_delimiter(self):
+        with test_db(self.tmpdir.name) as (db, _session):
+            self.assertEqual(
+                bulk_set_from_stdin_str(db, "no delimiter\n").returncode, 1
+            )
+
+    def test_bulk_set_errors_if_key_or_namespace_is_empty(self):
+        with test_db(self.tmpdir.name) as (db, _session), random_kv() as (_key, value):
+            self.assertEqual(bulk_set(db, [("", value)]).returncode, 1)
+            self.assertEqual(bulk_set(db, [("@namespace", value)]).returncode, 1)
+            self.assertEqual(bulk_set(db, [("abc@", value)]).returncode, 1)
+
+    def test_bulk_set_rolls_back_whole_batch_on_error(self):
+        with (
+            test_db(self.tmpdir.name) as (db, session),
+            random_kv() as (key1, value1),
+            random_kv() as (key2, value2),
+        ):
+            set_out = bulk_set_from_stdin_str(
+                db, f"{key1}\t{value1}\nno delimiter\n{key2}\t{value2}\n"
             )
+            self.assertEqual(set_out.returncode, 1)
+
+            self.assertEqual(get(session, key1).stdout, b"")
+            self.assertEqual(get(session, key2).stdout, b"")
+            self.assertEqual(list(session).stdout, b"")
+
+    def test_repl_reports_extra_separator_as_error(self):
+        with test_db(self.tmpdir.name) as (_db, session), random_kv() as (key, value):
+            # an argument with a `\x1e` in it arrives as two arguments
+            session.process.stdin.write(f"get\x1e{key}\x1eextra\n".encode("utf-8"))
+            session.process.stdin.flush()
+
+            bad_out = session.read_response(["get", key, "extra"])
+            self.assertEqual(bad_out.returncode, 1)
+            self.assertEqual(bad_out.stdout, b"")
+
+            self.assertEqual(set(session, key, value).returncode, 0)
+            self.assertEqual(get(session, key).stdout, (value + "\n").encode("utf-8"))
+
+    def test_repl_survives_non_utf8_line(self):
+        with test_db(self.tmpdir.name) as (_db, session), random_kv() as (key, value):
+            session.process.stdin.write(b"get\x1e\xff\n")
+            session.process.stdin.flush()
+
+            bad_out = session.read_response(["get", "\xff"])
+            self.assertEqual(bad_out.returncode, 1)
+            self.assertEqual(bad_out.stdout, b"")
+
+            self.assertEqual(set(session, key, value).returncode, 0)
+            self.assertEqual(get(session, key).stdout, (value + "\n").encode("utf-8"))
 
     def test_dump_config(self):
-        with test_db() as db:
-            dump_config_out = dump_config(db)
-            self.assertIn("db_location = ", dump_config_out.stdout)
-            self.assertIn("blade.db", dump_config_out.stdout)
-            self.assertIn('sqlite_synchronous_mode = "normal"', dump_config_out.stdout)
-            self.assertIn("sqlite_busy_timeout_ms = 5000", dump_config_out.stdout)
+        with test_db(self.tmpdir.name) as (_db, session):
+            dump_config_out = dump_config(session)
+            self.assertIn(b"db_location = ", dump_config_out.stdout)
+            self.assertIn(b"blade.db", dump_config_out.stdout)
+            self.assertIn(b'sqlite_synchronous_mode = "normal"', dump_config_out.stdout)
+            self.assertIn(b"sqlite_busy_timeout_ms = 5000", dump_config_out.stdout)
 
     def test_errors_if_key_is_empty(self):
-        with test_db() as db, random_kv() as (_key, value):
-            self.assertEqual(set(db, "", value).returncode, 1)
-            self.assertEqual(set(db, " ", value).returncode, 1)
-            self.assertEqual(set(db, "@namespace", value).returncode, 1)
-            self.assertEqual(set(db, "  @namespace", value).returncode, 1)
+        with test_db(self.tmpdir.name) as (_db, session), random_kv() as (_key, value):
+            self.assertEqual(set(session, "", value).returncode, 1)
+            self.assertEqual(set(session, " ", value).returncode, 1)
+            self.assertEqual(set(session, "@namespace", value).returncode, 1)
+            self.assertEqual(set(session, "  @namespace", value).returncode, 1)
 
-            self.assertEqual(get(db, "").returncode, 1)
-            self.assertEqual(get(db, " ").returncode, 1)
-            self.assertEqual(get(db, "@namespace").returncode, 1)
-            self.assertEqual(get(db, "  @namespace").returncode, 1)
+            self.assertEqual(get(session, "").returncode, 1)
+            self.assertEqual(get(session, " ").returncode, 1)
+            self.assertEqual(get(session, "@namespace").returncode, 1)
+            self.assertEqual(get(session, "  @namespace").returncode, 1)
 
     def test_errors_if_namespace_is_empty(self):
-        with test_db() as db, random_kv() as (_key, value):
-            self.assertEqual(set(db, "abc@", value).returncode, 1)
-            self.assertEqual(set(db, "abc@   ", value).returncode, 1)
+        with test_db(self.tmpdir.name) as (_db, session), random_kv() as (_key, value):
+            self.assertEqual(set(session, "abc@", value).returncode, 1)
+            self.assertEqual(set(session, "abc@   ", value).returncode, 1)
+
+            self.assertEqual(get(session, "abc@").returncode, 1)
+            self.assertEqual(get(session, "abc@    ").returncode, 1)
+
+    def test_commands_as_separate_processes(self):
+        with (
+            test_db(self.tmpdir.name) as (db, _session),
+            random_kv() as (key, value),
+        ):
+            set_out = run_process(db, ["set", key, value])
+            self.assertEqual(set_out.returncode, 0)
+
+            get_out = run_process(db, ["get", key])
+            self.assertEqual(get_out.returncode, 0)
+            self.assertEqual(get_out.stdout, (value + "\n").encode("utf-8"))
+
+            list_out = run_process(db, ["list"])
+            self.assertEqual(list_out.returncode, 0)
+            self.assertEqual(list_out.stdout, f"{key}\t{value}\n".encode("utf-8"))
+
+            list_namespaces_out = run_process(db, ["list-namespaces"])
+            self.assertEqual(list_namespaces_out.returncode, 0)
+            self.assertEqual(list_namespaces_out.stdout, b"default\n")
+
+            dump_config_out = run_process(db, ["dump-config"])
+            self.assertEqual(dump_config_out.returncode, 0)
+            self.assertIn(b"db_location = ", dump_config_out.stdout)
+
+            delete_out = run_process(db, ["delete", key])
+            self.assertEqual(delete_out.returncode, 0)
+            self.assertEqual(delete_out.stdout, b"")
+
+            self.assertEqual(run_process(db, ["get", key]).stdout, b"")
+
+    def test_errors_exit_separate_process_with_1(self):
+        with test_db(self.tmpdir.name) as (db, _session), random_kv() as (_key, value):
+            self.assertEqual(run_process(db, ["set", "", value]).returncode, 1)
+            self.assertEqual(run_process(db, ["get", "abc@"]).returncode, 1)
+
+    def test_concurrent_first_runs_agree_on_config(self):
+        home = tempfile.mkdtemp(dir=self.tmpdir.name)
+
+        processes = [
+            subprocess.Popen(
+                [_BLADE, "dump-config"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                env=_BASE_ENV
+                | {"HOME": home, "DB_LOCATION": f"{home}/{uuid.uuid4().hex}.db"},
+            )
+            for _ in range(8)
+        ]
+
+        outs = [process.communicate()[0] for process in processes]
 
-            self.assertEqual(get(db, "abc@").returncode, 1)
-            self.assertEqual(get(db, "abc@    ").returncode, 1)
+        self.assertEqual([process.returncode for process in processes], [0] * 8)
+        self.assertEqual(len({*outs}), 1)
+        self.assertIn(b"db_location = ", outs[0])
+        self.assertEqual(os.listdir(f"{home}/.config/blade"), ["config.toml"])
 
 
 if __name__ == "__main__":